@@ -1,10 +1,6 @@
+from importlib import import_module
 from importlib.metadata import version, PackageNotFoundError
 
-from .snowblind import SnowblindStep
-from .jump_plus import JumpPlusStep
-from .selfcal import OpenPixelStep
-from .persist import PersistenceFlagStep
-
 
 try:
     __version__ = version(__package__ or __name__)
@@ -12,15 +8,42 @@ except PackageNotFoundError:
     __version__ = "dev"
 
 
+# These are imported on first access (PEP 562), so that stpipe can discover the
+# steps through _get_steps() without importing jwst, skimage and astropy
+_LAZY_IMPORTS = {
+    'SnowblindStep': '.snowblind',
+    'JumpPlusStep': '.jump_plus',
+    'OpenPixelStep': '.selfcal',
+    'PersistenceFlagStep': '.persist',
+    'apply_dq_delta': '.dqdelta',
+    'open_with_dq_delta': '.dqdelta',
+}
+
+
 __all__ = [
     '__version__',
     'SnowblindStep',
     'JumpPlusStep',
     'OpenPixelStep',
     'PersistenceFlagStep',
+    'apply_dq_delta',
+    'open_with_dq_delta',
 ]
 
 
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        value = getattr(import_module(_LAZY_IMPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
 def _get_steps():
     """These steps are provided to stpipe by this package
     """
@@ -0,0 +1,111 @@
+import hashlib
+import os
+from pathlib import Path
+import tempfile
+import zipfile
+
+import numpy as np
+
+
+# Bump this if the output of the cached computation changes for the same inputs
+CACHE_VERSION = 2
+
+
+class MaskCache:
+    """On-disk, content-addressed cache of boolean masks
+
+    Masks are stored bit-packed, one ``.npz`` file per key, optionally with other
+    small arrays that go with the result.  The key is a hash
+    of the bit-packed input mask plus the parameters that the result depends on,
+    so reprocessing unchanged data only costs hashing and I/O.  When the total
+    size of the cache exceeds ``max_size`` bytes, the least recently used
+    entries are evicted by :meth:`prune`.
+    """
+
+    suffix = ".npz"
+
+    def __init__(self, path, max_size=1024 * 1024**2):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, mask, **params):
+        """Hash a boolean mask and keyword parameters into a hex string key
+        """
+        mask = np.asarray(mask, dtype=bool)
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f"{CACHE_VERSION}|{mask.shape}|{sorted(params.items())}".encode())
+        h.update(np.packbits(mask).tobytes())
+
+        return h.hexdigest()
+
+    def _filename(self, key):
+        return self.path / f"{key}{self.suffix}"
+
+    def get(self, key, shape):
+        """Return the cached boolean mask of ``shape`` and dict of other arrays for ``key``, or None
+        """
+        filename = self._filename(key)
+        try:
+            with np.load(filename) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+            packed = arrays.pop("mask")
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            # Empty, truncated or otherwise damaged entry, e.g. on a shared filesystem
+            filename.unlink(missing_ok=True)
+            self.misses += 1
+            return None
+
+        # Mark the entry as recently used for LRU eviction
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+        self.hits += 1
+
+        count = int(np.prod(shape))
+        mask = np.unpackbits(packed, count=count).reshape(shape).astype(bool)
+
+        return mask, arrays
+
+    def put(self, key, mask, **arrays):
+        """Store a boolean mask, and optionally other named arrays, under ``key``
+        """
+        packed = np.packbits(np.asarray(mask, dtype=bool))
+
+        # Write to a temporary file and rename, so concurrent readers never see
+        # a partially written entry
+        fd, tmp_name = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, mask=packed, **arrays)
+            os.replace(tmp_name, self._filename(key))
+        except OSError:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+    def prune(self):
+        """Evict least recently used entries until the cache fits in ``max_size``
+        """
+        entries = []
+        for filename in self.path.glob(f"*{self.suffix}"):
+            try:
+                stat = filename.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, filename in entries:
+            if total <= self.max_size:
+                break
+            filename.unlink(missing_ok=True)
+            total -= size
+
+        return total
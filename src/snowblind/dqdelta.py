@@ -0,0 +1,250 @@
+from os.path import splitext
+
+import numpy as np
+
+
+DQ_DELTA_SUFFIX = "dqdelta"
+
+
+def compute_dq_delta(original, updated):
+    """Get the DQ bits set in ``updated`` that are not set in ``original``
+
+    Returns
+    -------
+    index : array-like, int
+        Flat indices into the DQ array of pixels with added bits
+    bits : array-like
+        The added bits for each of those pixels
+    """
+    added = np.asarray(updated) & ~np.asarray(original)
+    index = np.flatnonzero(added)
+    bits = added.ravel()[index]
+
+    # Most DQ arrays are small enough for 32-bit indices
+    if added.size < 2**31:
+        index = index.astype(np.int32)
+
+    return index, bits
+
+
+def compute_flag_delta(dq, added, flag):
+    """Get the DQ delta of setting ``flag`` where ``added`` is True, before it is set
+
+    Only the flagged pixels are looked at, so unlike `compute_dq_delta` this needs
+    no copy of the DQ array.
+
+    Returns
+    -------
+    index : array-like, int
+        Flat indices into the DQ array of pixels with added bits
+    bits : array-like
+        The bits of ``flag`` not yet set for each of those pixels
+    """
+    index = np.flatnonzero(added)
+    bits = (flag & ~dq.ravel()[index]).astype(dq.dtype)
+    index = index[bits != 0]
+    bits = bits[bits != 0]
+
+    if dq.size < 2**31:
+        index = index.astype(np.int32)
+
+    return index, bits
+
+
+def write_dq_delta(filename, deltas, source=None, cal_step=None):
+    """Write sparse DQ deltas to a FITS sidecar file
+
+    Parameters
+    ----------
+    filename : str or Path
+        Output filename
+
+    deltas : dict
+        ``{extname: (shape, index, bits)}``, e.g. ``{"groupdq": ...}``, with
+        ``index`` and ``bits`` as returned by `compute_dq_delta`
+
+    source : str or None
+        Filename of the product the deltas apply to
+
+    cal_step : (str, str) or None
+        ``(class_alias, status)`` of the step that added the flags
+    """
+    from astropy.io import fits
+
+    primary = fits.PrimaryHDU()
+    if source is not None:
+        primary.header["SRCFILE"] = source
+    if cal_step is not None:
+        primary.header["CALSTEP"] = (cal_step[0], "Step that added the DQ flags")
+        primary.header["CALSTAT"] = (cal_step[1], "Status of the step")
+
+    hdus = [primary]
+    for extname, (shape, index, bits) in deltas.items():
+        hdu = fits.BinTableHDU.from_columns([
+            fits.Column(name="INDEX", format="J" if index.dtype == np.int32 else "K", array=index),
+            _bits_column(bits),
+        ], name=extname.upper())
+        hdu.header["DQSHAPE"] = (",".join(str(n) for n in shape), "Shape of the DQ array")
+        hdus.append(hdu)
+
+    fits.HDUList(hdus).writeto(filename, overwrite=True)
+
+
+def _bits_column(bits):
+    """FITS table column for DQ bits, storing unsigned integers with the usual offset
+    """
+    from astropy.io import fits
+
+    itemsize = bits.dtype.itemsize
+    bzero = None
+    if bits.dtype.kind == "u" and itemsize > 1:
+        # FITS only has signed 16, 32 and 64-bit integers
+        bzero = 2**(8 * itemsize - 1)
+
+    return fits.Column(name="BITS", format={1: "B", 2: "I", 4: "J", 8: "K"}[itemsize], bzero=bzero, array=bits)
+
+
+def read_dq_delta(filename):
+    """Read sparse DQ deltas from a FITS sidecar file
+
+    Returns
+    -------
+    deltas : dict
+        ``{extname: (shape, index, bits)}``, with lowercase extension names
+    header : `~astropy.io.fits.Header`
+        Primary header of the sidecar
+    """
+    from astropy.io import fits
+
+    deltas = {}
+    with fits.open(filename) as hdulist:
+        header = hdulist[0].header.copy()
+        for hdu in hdulist[1:]:
+            shape = tuple(int(n) for n in hdu.header["DQSHAPE"].split(","))
+            deltas[hdu.name.lower()] = (shape, np.array(hdu.data["INDEX"]), np.array(hdu.data["BITS"]))
+
+    return deltas, header
+
+
+def apply_dq_delta(model, filename):
+    """Merge the DQ flags of a sidecar file onto a datamodel, in place
+
+    Parameters
+    ----------
+    model : `~jwst.datamodels.JwstDataModel`
+        The product the sidecar was made for, e.g. the input to the step
+
+    filename : str or Path
+        Sidecar written with ``dq_delta=True``
+
+    Returns
+    -------
+    `~jwst.datamodels.JwstDataModel`
+        The updated model
+    """
+    deltas, header = read_dq_delta(filename)
+
+    for extname, (shape, index, bits) in deltas.items():
+        dq = getattr(model, extname)
+        if dq.shape != shape:
+            raise ValueError(f"DQ delta for {extname} has shape {shape}, but {model.meta.filename} has {dq.shape}")
+        dq[np.unravel_index(index, shape)] |= bits.astype(dq.dtype)
+
+    if "CALSTEP" in header:
+        setattr(model.meta.cal_step, header["CALSTEP"], header["CALSTAT"])
+
+    return model
+
+
+def open_with_dq_delta(input_data, filename):
+    """Open a datamodel and merge the DQ flags of a sidecar file onto it
+    """
+    from jwst import datamodels
+
+    return apply_dq_delta(datamodels.open(input_data), filename)
+
+
+class DQDeltaMixin:
+    """Save only the DQ flags added by a step, as a sparse sidecar file
+
+    Steps using this have a ``dq_delta`` parameter, and call `record_dq_delta`
+    for each output model whose DQ they modified, or `record_flag_delta` before
+    setting a flag.  When ``dq_delta`` is set,
+    saving those models writes a ``_dqdelta.fits`` sidecar of the added flags
+    instead of the full product.  The recorded deltas only live for one run.
+    """
+
+    _dq_deltas = None
+
+    def run(self, *args):
+        # The results are saved within run(), so the recorded deltas, which hold a
+        # reference to each output model, are not needed afterwards
+        self._dq_deltas = None
+        try:
+            return super().run(*args)
+        finally:
+            self._dq_deltas = None
+
+    def record_dq_delta(self, model, original, extname="dq"):
+        """Record the DQ flags added to ``model.<extname>`` relative to ``original``
+        """
+        if not self.dq_delta:
+            return
+
+        if self._dq_deltas is None:
+            self._dq_deltas = {}
+
+        updated = getattr(model, extname)
+        index, bits = compute_dq_delta(original, updated)
+        self._dq_deltas[id(model)] = (model, extname, (updated.shape, index, bits))
+
+    def record_flag_delta(self, model, added, flag, extname="dq"):
+        """Record the DQ flags that setting ``flag`` where ``added`` is True will add
+
+        Call this before setting the flags in ``model.<extname>``.
+        """
+        if not self.dq_delta:
+            return
+
+        if self._dq_deltas is None:
+            self._dq_deltas = {}
+
+        dq = getattr(model, extname)
+        index, bits = compute_flag_delta(dq, added, flag)
+        self._dq_deltas[id(model)] = (model, extname, (dq.shape, index, bits))
+
+    def save_model(self, model, suffix=None, idx=None, output_file=None, force=False, **components):
+        record = None
+        if self.dq_delta and self._dq_deltas is not None:
+            record = self._dq_deltas.get(id(model))
+
+        if force or record is None or record[0] is not model:
+            return super().save_model(
+                model, suffix=suffix, idx=idx, output_file=output_file, force=force, **components
+            )
+
+        if output_file is None or output_file == "":
+            output_file = self.output_file
+
+        if not self.save_results and not output_file:
+            return None
+
+        # Same output naming as Step.save_model()
+        if self.output_use_model or (output_file is None and not self.search_output_file):
+            output_file = model.meta.filename
+            idx = None
+
+        root, ext = splitext(self.make_output_path(basepath=output_file, suffix=suffix, idx=idx, **components))
+        output_path = f"{root}_{DQ_DELTA_SUFFIX}{ext}"
+
+        _, extname, delta = record
+        cal_step = None
+        if self.class_alias is not None:
+            status = getattr(model.meta.cal_step, self.class_alias, None)
+            if status is not None:
+                cal_step = (self.class_alias, status)
+
+        write_dq_delta(output_path, {extname: delta}, source=model.meta.filename, cal_step=cal_step)
+        self.log.info(f"Saved {len(delta[1])} DQ deltas in {output_path}")
+
+        return output_path
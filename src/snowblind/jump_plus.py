@@ -2,12 +2,14 @@ import numpy as np
 from jwst import datamodels
 from jwst.stpipe import Step
 
+from .dqdelta import DQDeltaMixin
+
 
 JUMP_DET = datamodels.dqflags.group["JUMP_DET"]
 SATURATED = datamodels.dqflags.group["SATURATED"]
 
 
-class JumpPlusStep(Step):
+class JumpPlusStep(DQDeltaMixin, Step):
     """Updates groupdq by propagating jumps in group N to group N+1
 
     For NIR readout modes that average together more than one frames
@@ -19,6 +21,7 @@ class JumpPlusStep(Step):
     frame in a previous group, so flag those as jumps as well.
     """
     spec = """
+        dq_delta = boolean(default=False) # save only the added DQ flags in a _dqdelta sidecar
     """
 
     class_alias = "jump_plus"
@@ -42,6 +45,8 @@ class JumpPlusStep(Step):
 
             return result
 
+        original_dq = result.groupdq.copy() if self.dq_delta else None
+
         for integration_dq in result.groupdq:
             # Make jump DQ for the integration where flagged jumps in group N
             # propagate to the group N+1
@@ -60,6 +65,8 @@ class JumpPlusStep(Step):
             # Add the new SATURADED flags for the integration
             integration_dq |= before_sat_dq
 
+        self.record_dq_delta(result, original_dq, "groupdq")
+
         setattr(result.meta.cal_step, self.class_alias, "COMPLETE")
 
         return result
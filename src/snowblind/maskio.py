@@ -0,0 +1,101 @@
+from pathlib import Path
+
+import numpy as np
+
+
+def write_mask(filename, mask, header=None):
+    """Write a boolean mask to a compact FITS file
+
+    The mask is bit-packed along its last axis into a ``MASK`` uint8 image
+    extension, 8 times smaller than a uint8 mask, and can be memory-mapped
+    when read back with `read_mask`.
+
+    Parameters
+    ----------
+    filename : str or Path
+        Output filename
+
+    mask : array-like, bool
+        Mask of any dimensions
+
+    header : dict or None
+        Extra keywords for the primary header, e.g. for provenance
+    """
+    from astropy.io import fits
+
+    mask = np.asarray(mask, dtype=bool)
+
+    primary = fits.PrimaryHDU()
+    for key, value in (header or {}).items():
+        primary.header[key] = value
+
+    hdu = fits.ImageHDU(data=np.packbits(mask, axis=-1), name="MASK")
+    hdu.header["PACKED"] = (True, "Mask is bit-packed along the last axis")
+    hdu.header["MASKLEN"] = (mask.shape[-1], "Length of the unpacked last axis")
+
+    fits.HDUList([primary, hdu]).writeto(filename, overwrite=True)
+
+
+def read_mask(filename, index=None):
+    """Read a boolean mask written by `write_mask`
+
+    The packed data are memory-mapped, so only the part of the file needed
+    for ``index`` is read.
+
+    Parameters
+    ----------
+    filename : str or Path
+        Mask file
+
+    index : tuple or None
+        Optional index into the leading axes of the mask, e.g. ``(-1, -1)``
+        for the last group of the last integration of a 4D mask
+
+    Returns
+    -------
+    array-like, bool
+    """
+    from astropy.io import fits
+
+    with fits.open(filename, memmap=True) as hdulist:
+        hdu = hdulist["MASK"]
+        packed = hdu.data if index is None else hdu.data[index]
+        mask = np.unpackbits(packed, axis=-1, count=hdu.header["MASKLEN"]).astype(bool)
+
+    return mask
+
+
+def read_mask_header(filename):
+    """Read the primary header of a mask written by `write_mask`, e.g. to check its provenance
+
+    Returns
+    -------
+    `~astropy.io.fits.Header`
+    """
+    from astropy.io import fits
+
+    return fits.getheader(filename)
+
+
+def find_saved_mask(filename, directories):
+    """Find a saved mask in the first of ``directories`` that has it
+
+    Parameters
+    ----------
+    filename : str or Path
+        Mask filename; only its name is used
+
+    directories : list of str or Path
+        Directories to look in, in order, e.g. the step's ``input_dir`` and then where
+        ``save_mask`` writes, ``output_dir`` or the current directory
+
+    Returns
+    -------
+    Path or None
+    """
+    for directory in directories:
+        path = Path(directory or "") / Path(filename).name
+        if path.exists():
+            return path
+
+    return None
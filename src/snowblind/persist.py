@@ -1,18 +1,20 @@
 from pathlib import Path
 
-from astropy.time import Time
-from astropy.io import fits
 import numpy as np
 from jwst import datamodels
 from jwst.stpipe import Step
 
+from .dqdelta import DQDeltaMixin
+from .maskio import find_saved_mask, read_mask, write_mask
+from .prefetch import open_association, prefetch_map
+
 
 DO_NOT_USE = datamodels.dqflags.pixel["DO_NOT_USE"]
 SATURATED = datamodels.dqflags.group["SATURATED"]
 PERSISTENCE = datamodels.dqflags.pixel["PERSISTENCE"]
 
 
-class PersistenceFlagStep(Step):
+class PersistenceFlagStep(DQDeltaMixin, Step):
     """
     Given a series of exposures in an assocation, for any pixel flagged as saturated
     in one exposure, flag the pixel as DO_NOT_USE | PERSISTENCE in subsequent exposures
@@ -21,20 +23,26 @@ class PersistenceFlagStep(Step):
 
     spec = """
         time = float(default=2500.0)  # amount of time after exposure to flag [seconds]
-        save_mask = boolean(default=False)  # write out persistence mask for each exposure
+        save_mask = boolean(default=False)  # write out saturation mask for each exposure
+        packed_mask = boolean(default=False)  # save bit-packed 2D _packedsatmask files instead of _satmask cubes
+        use_saved_mask = boolean(default=False)  # read _packedsatmask files, from input_dir or output_dir
         output_use_model = boolean(default=True)
         output_use_index = boolean(default=False)
+        dq_delta = boolean(default=False)  # save only the added DQ flags in a _dqdelta sidecar
+        read_ahead = integer(default=2)  # number of exposures to read ahead in background threads
+        read_ahead_memory = float(default=2048.0)  # memory limit for read-ahead buffers, not for all exposures [MB]
     """
 
     class_alias = "persist"
 
     def process(self, input_data):
-        with datamodels.open(input_data) as images:
-            # Find detector names in the association
-            images_grouped_by_detector = {}
-            detector_names = set([image.meta.instrument.detector for image in images])
+        # Open the exposures, reading the DQ of the next ones in the background
+        results = open_association(input_data, arrays=("dq",),
+                                   depth=self.read_ahead, max_memory=self.read_ahead_memory)
 
-            results = images.copy()
+        # Find detector names in the association
+        images_grouped_by_detector = {}
+        detector_names = set([image.meta.instrument.detector for image in results])
 
         # Sort exposures into a dict, one list per detector
         for detector in detector_names:
@@ -54,6 +62,7 @@ class PersistenceFlagStep(Step):
             # Convert bool cube into PERSISTENCE flags for each image dq array
             for model, mask in zip(models_sorted, persist_bool):
                 self.log.info(f"Pixels flagged: {model.meta.filename} {mask.sum()}")
+                self.record_flag_delta(model, mask, DO_NOT_USE | PERSISTENCE)
                 model.dq |= (mask * (DO_NOT_USE | PERSISTENCE)).astype(np.uint32)
 
         return results
@@ -61,6 +70,8 @@ class PersistenceFlagStep(Step):
     def sort_by_start_times(self, images):
         """Returns sorted lists of datamodels and time_deltas between them [sec]
         """
+        from astropy.time import Time
+
         start_times = []
         for image in images:
             start_times.append((image.meta.exposure.start_time, image))
@@ -99,7 +110,7 @@ class PersistenceFlagStep(Step):
         return persist_cube
 
     def get_saturation_masks(self, models_sorted):
-        """Get boolean SATURATION mask from output of JumpStep
+        """Get boolean SATURATION mask from output of JumpStep, or from saved _satmask files
         """
         # For the list of input files, convert them to the _jump.fits filenames
         def jumpify(filename):
@@ -108,23 +119,49 @@ class PersistenceFlagStep(Step):
 
         file_names = [jumpify(m.meta.filename) for m in models_sorted]
 
-        masks = []
-        for f in file_names:
+        def read_saturation(f):
+            sat_mask_file = find_saved_mask(f.replace("_jump", "_packedsatmask"), [self.input_dir, self.output_dir])
+            if self.use_saved_mask and sat_mask_file is not None:
+                self.log.info(f"Reading saturation mask {sat_mask_file}")
+                return read_mask(sat_mask_file), None, None
+
             with datamodels.open(Path(self.input_dir) / f) as model:
-                mask = (model.groupdq & SATURATED) == SATURATED
+                if self.save_mask and not self.packed_mask:
+                    # The _satmask product is the whole saturation cube
+                    cube = (model.groupdq & SATURATED) == SATURATED
+                    mask = cube[-1, -1]
+                else:
+                    # Get the last group of the last integration, as this will have the
+                    # cummulative, uncorrected saturated pixels flagged.
+                    cube = mask = (model.groupdq[-1, -1] & SATURATED) == SATURATED
                 filename = model.meta.filename
 
-            # Get the last group of the last integration, as this will have the
-            # cummulative, uncorrected saturated pixels flagged.
-            masks.append(mask[-1, -1])
+            return mask, cube, filename
 
-            if self.save_mask:
-                sat_mask_name = filename.replace("_jump", "_satmask")
-                fits.HDUList(
-                    fits.PrimaryHDU(
-                        data=mask.astype(np.uint8)
-                    )
-                ).writeto(sat_mask_name, overwrite=True)
-                self.log.info(f"Writing out saturation mask {sat_mask_name}")
+        # Read the next _jump.fits files in the background while processing this one
+        masks = []
+        for mask, cube, filename in prefetch_map(read_saturation, file_names,
+                                                 depth=self.read_ahead, max_memory=self.read_ahead_memory):
+            masks.append(mask)
+
+            if self.save_mask and filename is not None:
+                self.save_saturation_mask(filename, cube)
 
         return np.array(masks)
+
+    def save_saturation_mask(self, filename, cube):
+        """Write the saturation mask of a _jump.fits file, bit-packed if packed_mask is set
+        """
+        from astropy.io import fits
+
+        if self.packed_mask:
+            sat_mask_name = Path(self.output_dir or "") / filename.replace("_jump", "_packedsatmask")
+            write_mask(sat_mask_name, cube)
+        else:
+            sat_mask_name = Path(self.output_dir or "") / filename.replace("_jump", "_satmask")
+            fits.HDUList(
+                fits.PrimaryHDU(
+                    data=cube.astype(np.uint8)
+                )
+            ).writeto(sat_mask_name, overwrite=True)
+        self.log.info(f"Writing out saturation mask {sat_mask_name}")
@@ -0,0 +1,157 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+
+def _nbytes(result):
+    """Approximate memory used by a result: arrays, datamodels, or tuples of those
+    """
+    if isinstance(result, (tuple, list)):
+        return sum(_nbytes(r) for r in result)
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if hasattr(result, "instance"):
+        # A datamodel; count its arrays
+        return sum(value.nbytes for value in result.instance.values() if isinstance(value, np.ndarray))
+    return 0
+
+
+def prefetch_map(function, items, depth=2, max_memory=None):
+    """Yield ``function(item)`` for each item in order, computing the next items in the background
+
+    While the caller processes one result, up to ``depth`` of the following items are
+    already being read by a pool of background threads.  Results are always yielded in
+    the order of ``items``.
+
+    Parameters
+    ----------
+    function : callable
+        Function of one item, e.g. reading the needed arrays of an exposure
+
+    items : iterable
+        Items to map ``function`` over
+
+    depth : int
+        Number of items to read ahead.  If 0, run sequentially without threads.
+
+    max_memory : float or None
+        Approximate limit on the memory held by the read-ahead buffers [MB].  Based on
+        the size of the results so far, fewer items are read ahead to stay below it,
+        but at least one.  Results already yielded are not counted, so this throttles
+        the reads in flight rather than capping the total memory.
+    """
+    if depth < 1:
+        for item in items:
+            yield function(item)
+        return
+
+    items = iter(items)
+    pending = deque()
+    sizes = []
+
+    def limit():
+        if max_memory is None or not sizes:
+            return depth
+        mean_size = max(np.mean(sizes), 1)
+        return int(np.clip(max_memory * 1024**2 // mean_size, 1, depth))
+
+    with ThreadPoolExecutor(max_workers=depth) as executor:
+        try:
+            exhausted = False
+            while True:
+                # Keep the current item plus up to depth more in flight
+                while not exhausted and len(pending) < limit() + 1:
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                    else:
+                        pending.append(executor.submit(function, item))
+
+                if not pending:
+                    break
+
+                result = pending.popleft().result()
+                sizes.append(_nbytes(result))
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def open_association(input_data, arrays=(), depth=2, max_memory=None):
+    """Open the members of an association, reading them in background threads
+
+    Each member file is opened, and its ``arrays`` read, by `prefetch_map`, so the
+    reads of the next members overlap.  The members are in association order.
+
+    Parameters
+    ----------
+    input_data : str, Path, list or `~jwst.datamodels.ModelContainer`
+        Association file, list of member files, or models already in memory.  Models
+        in memory are copied, as there is nothing to read.
+
+    arrays : tuple of str
+        Names of the arrays the step needs, e.g. ``("data", "dq")``
+
+    depth, max_memory
+        See `prefetch_map`.  ``max_memory`` only limits the reads in flight; all the
+        models are kept in the returned container.
+
+    Returns
+    -------
+    `~jwst.datamodels.ModelContainer`
+        Models owned by the caller
+    """
+    from jwst import datamodels
+    from jwst.datamodels.container import RECOGNIZED_MEMBER_FIELDS
+
+    members = None
+    container = datamodels.ModelContainer()
+
+    if isinstance(input_data, (str, Path)) and Path(input_data).suffix == ".json":
+        # Same as ModelContainer.from_asn(), opening the members in the background
+        asn_data = datamodels.ModelContainer.read_asn(input_data)
+        asn_dir = Path(input_data).parent
+        members = [dict(member, expname=asn_dir / member["expname"])
+                   for member in asn_data["products"][0]["members"]]
+        container.asn_table = asn_data
+        container.asn_file_path = input_data
+        container.asn_table_name = Path(input_data).name
+        container.asn_pool_name = asn_data["asn_pool"]
+    elif isinstance(input_data, (list, tuple)) and all(isinstance(f, (str, Path)) for f in input_data):
+        members = [dict(expname=f) for f in input_data]
+
+    if members is None:
+        with datamodels.open(input_data) as images:
+            return images.copy()
+
+    def read_member(member):
+        model = datamodels.open(member["expname"])
+        # Read the needed arrays in this thread
+        for name in arrays:
+            getattr(model, name)
+
+        if "exptype" in member:
+            model.meta.asn.exptype = member["exptype"]
+        for attr, value in member.items():
+            if attr == "tweakreg_catalog":
+                value = Path(member["expname"]).parent / value if value.strip() else None
+            if attr in RECOGNIZED_MEMBER_FIELDS:
+                setattr(model.meta, attr, value)
+        if container.asn_table_name is not None:
+            model.meta.asn.table_name = container.asn_table_name
+            model.meta.asn.pool_name = container.asn_pool_name
+
+        return model
+
+    try:
+        for model in prefetch_map(read_member, members, depth=depth, max_memory=max_memory):
+            container.append(model)
+    except Exception:
+        container.close()
+        raise
+
+    return container
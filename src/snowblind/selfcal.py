@@ -1,18 +1,22 @@
+import hashlib
 from os.path import commonprefix
 import warnings
 
-from astropy.stats import sigma_clipped_stats
 import numpy as np
 from jwst import datamodels
 from jwst.stpipe import Step
 
+from .dqdelta import DQDeltaMixin
+from .maskio import find_saved_mask, read_mask, read_mask_header, write_mask
+from .prefetch import open_association
+
 
 OPEN = datamodels.dqflags.pixel["OPEN"]
 ADJ_OPEN = datamodels.dqflags.pixel["ADJ_OPEN"]
 DO_NOT_USE = datamodels.dqflags.pixel["DO_NOT_USE"]
 
 
-class OpenPixelStep(Step):
+class OpenPixelStep(DQDeltaMixin, Step):
     """Flags cross-shaped and hot pixel defects caused by open pixels in NIR detectors
 
     Input is an assocation (or glob pattern of files) of all images in visit or program ID
@@ -30,47 +34,94 @@ class OpenPixelStep(Step):
     spec = """
         threshold = float(default=3.0)  # threshold in sigma to flag hot pixels above local background
         save_mask = boolean(default=False)  # write out per-detector bad-pixel mask and median
+        packed_mask = boolean(default=False)  # save bit-packed _packedmask files instead of _mask MaskModels
+        use_saved_mask = boolean(default=False)  # read per-detector _packedmask files, from input_dir or output_dir
         output_use_model = boolean(default=True)
         output_use_index = boolean(default=False)
         flag_low_signal_pix = boolean(default=False)
+        dq_delta = boolean(default=False)  # save only the added DQ flags in a _dqdelta sidecar
+        read_ahead = integer(default=2)  # number of exposures to read ahead in background threads
+        read_ahead_memory = float(default=2048.0)  # memory limit for read-ahead buffers, not for all exposures [MB]
     """
 
     class_alias = "open_pixel"
 
     def process(self, input_data):
-        with datamodels.open(input_data) as images:
-
-            # Sort into a dict of lists, grouped by detector
-            images_grouped_by_detector = {}
-            detector_names = set([image.meta.instrument.detector for image in images])
-            for detector in detector_names:
-                det_list = [i for i in images if i.meta.instrument.detector == detector]
-                images_grouped_by_detector.update({detector: det_list})
+        # Open the exposures, reading the data and DQ of the next ones in the background
+        results = open_association(input_data, arrays=("data", "dq"),
+                                   depth=self.read_ahead, max_memory=self.read_ahead_memory)
 
-            results = images.copy()
+        # Sort into a dict of lists, grouped by detector
+        images_grouped_by_detector = {}
+        detector_names = set([image.meta.instrument.detector for image in results])
+        for detector in detector_names:
+            det_list = [i for i in results if i.meta.instrument.detector == detector]
+            images_grouped_by_detector.update({detector: det_list})
 
         # For each detector represented in the association, compute a hot pixel mask and
         # np.bitwise_or() it with each input image for that detector
         for detector, models in images_grouped_by_detector.items():
-            image_stack = self.get_selfcal_stack(models)
-            self.log.info(f"Creating mask for detector {detector}")
-            mask, median = self.create_hotpixel_mask(image_stack)
-            self.log.info(f"Flagged {mask.sum()} pixels with {self.threshold} sigma")
-            if self.save_mask:
-                filename_prefix = f"{commonprefix([f.meta.filename for f in models])}_{detector.lower()}_{self.class_alias}"
-                mask_model = datamodels.MaskModel(data=mask.astype(np.uint8))
-                mask_model.meta.filename = f"{filename_prefix}.fits"
-                self.save_model(mask_model, suffix="mask", force=True)
-                median_model = datamodels.ImageModel(data=median)
-                median_model.meta.filename = f"{filename_prefix}.fits"
-                self.save_model(median_model, suffix="median", force=True)
+            filename_prefix = f"{commonprefix([f.meta.filename for f in models])}_{detector.lower()}_{self.class_alias}"
+            mask_file = self.make_output_path(basepath=f"{filename_prefix}.fits", suffix="packedmask")
+            saved_mask_file = find_saved_mask(mask_file, [self.input_dir, self.output_dir])
+
+            members = self.hash_members(models)
+            if self.use_saved_mask and self.saved_mask_matches(saved_mask_file, detector, members):
+                self.log.info(f"Reading mask for detector {detector} from {saved_mask_file}")
+                mask = read_mask(saved_mask_file)
+            else:
+                image_stack = self.get_selfcal_stack(models)
+                self.log.info(f"Creating mask for detector {detector}")
+                mask, median = self.create_hotpixel_mask(image_stack)
+                self.log.info(f"Flagged {mask.sum()} pixels with {self.threshold} sigma")
+
+                if self.save_mask:
+                    if self.packed_mask:
+                        header = dict(DETECTOR=detector, THRESHOL=self.threshold, LOWSIG=self.flag_low_signal_pix,
+                                      MEMBERS=members[0], NMEMBERS=members[1])
+                        write_mask(mask_file, mask, header=header)
+                        self.log.info(f"Saved mask in {mask_file}")
+                    else:
+                        mask_model = datamodels.MaskModel(dq=(mask * (DO_NOT_USE | ADJ_OPEN)).astype(np.uint32))
+                        mask_model.meta.filename = f"{filename_prefix}.fits"
+                        self.save_model(mask_model, suffix="mask", force=True)
+                    median_model = datamodels.ImageModel(data=median)
+                    median_model.meta.filename = f"{filename_prefix}.fits"
+                    self.save_model(median_model, suffix="median", force=True)
 
             for result in results:
                 if result.meta.instrument.detector == detector:
+                    self.record_flag_delta(result, mask, DO_NOT_USE | ADJ_OPEN)
                     result.dq |= (mask * (DO_NOT_USE | ADJ_OPEN)).astype(np.uint32)
 
         return results
 
+    def hash_members(self, models):
+        """Hash and number of the exposures a mask is made from, by sorted filename
+        """
+        h = hashlib.blake2b(digest_size=8)
+        h.update("\n".join(sorted(m.meta.filename for m in models)).encode())
+
+        return h.hexdigest(), len(models)
+
+    def saved_mask_matches(self, filename, detector, members):
+        """Check that a mask saved by save_mask exists and was made for this detector,
+        parameters and set of exposures
+        """
+        if filename is None:
+            return False
+
+        header = read_mask_header(filename)
+        keys = ("DETECTOR", "THRESHOL", "LOWSIG", "MEMBERS", "NMEMBERS")
+        saved = tuple(header.get(key) for key in keys)
+        expected = (detector, self.threshold, self.flag_low_signal_pix, *members)
+        if saved != expected:
+            self.log.warning(f"Saved mask {filename} has {', '.join(keys)} = {saved}, "
+                             f"but expected {expected}; recomputing it")
+            return False
+
+        return True
+
     def get_selfcal_stack(self, images):
         """
         Get a stack of exposures taken with same detector as the data
@@ -82,6 +133,8 @@ class OpenPixelStep(Step):
         return np.array(stack)
 
     def create_hotpixel_mask(self, image_stack):
+        from astropy.stats import sigma_clipped_stats
+
         # Median collapse the stack of images
         with warnings.catch_warnings():
             warnings.filterwarnings(action="ignore", message="All-NaN slice encountered")
@@ -1,38 +1,84 @@
+import scipy
 import skimage
 import numpy as np
 from jwst import datamodels
 from jwst.stpipe import Step
 
+from .cache import MaskCache
+from .dqdelta import DQDeltaMixin
+
 
 JUMP_DET = datamodels.dqflags.group["JUMP_DET"]
 SATURATED = datamodels.dqflags.group["SATURATED"]
 
 
-class SnowblindStep(Step):
+def label_statistics(labels, nlabels):
+    """
+    Measure the area, centroid and bounding box of every label in a 2D label image at once
+
+    Parameters
+    ----------
+    labels : array-like, int
+        Label image, with labels ``1..nlabels`` and 0 as background
+
+    nlabels : int
+        Number of labels
+
+    Returns
+    -------
+    areas : array-like, int
+        Number of pixels of each label, shape ``(nlabels,)``
+    centroids : array-like, float
+        ``(y, x)`` centroid of each label, shape ``(nlabels, 2)``
+    bboxes : list of (slice, slice)
+        Bounding box of each label, as from `scipy.ndimage.find_objects`
+    """
+    ys, xs = np.nonzero(labels)
+    flat_labels = labels[ys, xs]
+
+    areas = np.bincount(flat_labels, minlength=nlabels + 1)[1:]
+    with np.errstate(invalid="ignore"):
+        centroids = np.stack([
+            np.bincount(flat_labels, weights=ys, minlength=nlabels + 1)[1:] / areas,
+            np.bincount(flat_labels, weights=xs, minlength=nlabels + 1)[1:] / areas,
+        ], axis=-1)
+    bboxes = scipy.ndimage.find_objects(labels, max_label=nlabels)
+
+    return areas, centroids, bboxes
+
+
+class SnowblindStep(DQDeltaMixin, Step):
     spec = f"""
         min_radius = integer(default=4) # Minimum radius of connected pixels in CR
         growth_factor = float(default=2.0) # scale factor to dilate large CR events
         after_jumps = integer(default=2) # number of groups to flag around saturated cores after a jump
         ring_width = float(default=2.0) # number of pixels to dilate around saturated cores
         new_jump_flag = integer(default={JUMP_DET}) # DQ flag to set for dilated jumps
+        cache_dir = string(default=None) # directory for on-disk cache of dilated jump masks
+        cache_size = float(default=1024.0) # maximum size of the on-disk cache [MB]
+        dq_delta = boolean(default=False) # save only the added DQ flags in a _dqdelta sidecar
     """
 
     class_alias = "snowblind"
 
+    _cache = None
+
     def process(self, input_data):
         with datamodels.open(input_data) as jump:
             result = jump.copy()
-            if hasattr(jump, 'groupdq'):
-                self._has_groups = True
-                bool_jump = (jump.groupdq & JUMP_DET) == JUMP_DET
-                bool_sat = (jump.groupdq & SATURATED) == SATURATED
-            else:
-                self._has_groups = False
-                bool_jump = (jump.dq & JUMP_DET) == JUMP_DET
-                bool_sat = (jump.dq & SATURATED) == SATURATED
+            bool_jump, bool_sat = self.get_masks(jump)
+
+        if self.cache_dir is not None:
+            self._cache = MaskCache(self.cache_dir, max_size=int(self.cache_size * 1024**2))
 
-        # Expand jumps with large areas by self.growth_factor
-        dilated_jumps = self.dilate_large_area_jumps(bool_jump)
+        try:
+            # Expand jumps with large areas by self.growth_factor
+            dilated_jumps = self.dilate_large_area_jumps(bool_jump)
+        finally:
+            if self._cache is not None:
+                self.log.info(f"Dilated jump cache: {self._cache.hits} hits, {self._cache.misses} misses")
+                self._cache.prune()
+                self._cache = None
 
         # bitwise OR together the dilated masks with the original GROUPDQ mask
         # We set the dilated saturated cores as jumps, as they are not saturated
@@ -40,9 +86,11 @@ class SnowblindStep(Step):
             # Expand saturated cores within large event jumps by 2 pixels
             dilated_sats = self.dilate_saturated_cores(bool_sat, dilated_jumps)
 
-            result.groupdq |= (dilated_jumps * self.new_jump_flag).astype(np.uint32)
-            result.groupdq |= (dilated_sats * self.new_jump_flag).astype(np.uint32)
+            dilated = dilated_jumps | dilated_sats
+            self.record_flag_delta(result, dilated, self.new_jump_flag, "groupdq")
+            result.groupdq |= (dilated * self.new_jump_flag).astype(np.uint32)
         else:
+            self.record_flag_delta(result, dilated_jumps, self.new_jump_flag, "dq")
             result.dq |= (dilated_jumps * self.new_jump_flag).astype(np.uint32)
 
         # Update the metadata with the step completion status
@@ -50,65 +98,188 @@ class SnowblindStep(Step):
 
         return result
 
-    def dilate_jump_slice(self, jump_slice, ig=None):
+    def get_masks(self, model):
         """
-        Dilate a boolean mask with contiguous large areas by a self.growth_factor
+        Get boolean JUMP_DET and SATURATED masks from GROUPDQ, or DQ if there are no groups
+        """
+        if hasattr(model, 'groupdq'):
+            self._has_groups = True
+            dq = model.groupdq
+        else:
+            self._has_groups = False
+            dq = model.dq
 
-        Parameters
-        ----------
-        bool_jump : array-like, bool
+        bool_jump = (dq & JUMP_DET) == JUMP_DET
+        bool_sat = (dq & SATURATED) == SATURATED
 
-        ig : (int, int) or None
-            Integer indices of ``(integer, group)`` for logging
+        return bool_jump, bool_sat
+
+    def fill_cores(self, jump_slice):
+        """
+        Fill holes in the flagged areas of a boolean mask (i.e. the saturated cores)
+        """
+        return skimage.morphology.remove_small_holes(jump_slice, area_threshold=200)
+
+    def label_large_events(self, cores_filled, min_radius):
+        """
+        Remove events smaller than a disk of ``min_radius`` and label the remaining ones
 
         Returns
         -------
-        array-like, bool
+        big_events : array-like, bool
+            Mask of the large area events
+        event_labels : array-like, int
+            Segmentation map of the large area events
+        event_stats : tuple
+            ``(areas, centroids, bboxes)`` of each labeled event, see `label_statistics`
         """
         # Create a mask to remove small CR events, used by binary_opening()
-        disk = skimage.morphology.disk(radius=self.min_radius)
-
-        # Fill holes in the flagged areas (i.e. the saturated cores)
-        cores_filled = skimage.morphology.remove_small_holes(jump_slice, area_threshold=200)
+        disk = skimage.morphology.disk(radius=min_radius)
 
         # Get rid of the small-area jumps, leaving only large area CR events
         big_events = skimage.morphology.binary_opening(cores_filled, footprint=disk)
 
         # Label and get properites of each large area event
         event_labels, nlabels = skimage.measure.label(big_events, return_num=True)
-        region_properties = skimage.measure.regionprops(event_labels)
+        event_stats = label_statistics(event_labels, nlabels)
 
-        # Break up the segmentation map <event_labels> into a slice for each labeled event
-        # For each labeled event, measure its size, and dilate by <growth_factor> * size
+        return big_events, event_labels, event_stats
 
-        event_dilated = np.zeros_like(jump_slice)
+    def dilate_events(self, big_events, event_labels, event_stats, growth_factors):
+        """
+        Dilate each labeled event by its equal-area radius times each of ``growth_factors``
+
+        The distance transform of each event is computed once, within its bounding box
+        padded by the largest dilation radius, and shared by all growth factors.
+
+        Returns
+        -------
+        dict
+            Boolean mask of the dilated events for each growth factor
+        """
+        event_dilated = {gf: np.zeros_like(big_events) for gf in growth_factors}
+
+        for gf in event_dilated:
+            if gf == 0:
+                event_dilated[gf] |= big_events
 
-        if self.growth_factor == 0:
-            event_dilated |= big_events
+        growth_factors = [gf for gf in event_dilated if gf != 0]
+        if not growth_factors:
             return event_dilated
 
+        areas, _, bboxes = event_stats
+
+        # Compute radius from equal-area circle, and dilate each event by <growth_factor> * radius
+        radii = np.sqrt(areas / np.pi)
+        dilate_radii = {gf: np.ceil(radii * gf) for gf in growth_factors}
+        pads = np.maximum(np.max(list(dilate_radii.values()), axis=0), 1).astype(int)
+
+        ny, nx = event_labels.shape
         # zero-indexed loop, but labels are 1-indexed
-        for label, region in zip(range(1, nlabels + 1), region_properties):
+        for i, ((ys, xs), pad) in enumerate(zip(bboxes, pads)):
+            # Pixels further than the dilation radius from the bounding box are unaffected
+            crop = (
+                slice(max(ys.start - pad, 0), min(ys.stop + pad, ny)),
+                slice(max(xs.start - pad, 0), min(xs.stop + pad, nx)),
+            )
             # make a boolean slice for each labelled event
-            segmentation_slice = event_labels == label
-            # Compute radius from equal-area circle
-            radius = np.sqrt(region.area / np.pi)
-            dilate_radius = np.ceil(radius * self.growth_factor)
-            # Warn if there are very large snowballs or showers detected
-            if region.area > 900:
-                y, x = region.centroid
-                if ig is None:
-                    msg = f"Large CR masked with radius={radius:.1f} at [{round(y)}, {round(x)}]"
-
+            segmentation_slice = event_labels[crop] == i + 1
+
+            # Same as skimage.morphology.isotropic_dilation/erosion, keeping the distances
+            distance_outside = distance_inside = None
+            for gf in growth_factors:
+                dilate_radius = dilate_radii[gf][i]
+                if dilate_radius > 0:
+                    if distance_outside is None:
+                        distance_outside = scipy.ndimage.distance_transform_edt(~segmentation_slice)
+                    event_dilated[gf][crop] |= distance_outside <= dilate_radius
                 else:
-                    msg = f"Large CR masked with radius={radius:.1f} at [{ig[0]}, {ig[1]}, {round(y)}, {round(x)}]"
+                    if distance_inside is None:
+                        distance_inside = scipy.ndimage.distance_transform_edt(segmentation_slice)
+                    event_dilated[gf][crop] |= distance_inside > -dilate_radius
+
+        return event_dilated
+
+    def warn_large_events(self, event_stats, ig=None):
+        """
+        Warn if there are very large snowballs or showers detected
+        """
+        areas, centroids, _ = event_stats
 
-                self.log.warning(msg)
+        for area, (y, x) in zip(areas[areas > 900], centroids[areas > 900]):
+            radius = np.sqrt(area / np.pi)
+            if ig is None:
+                msg = f"Large CR masked with radius={radius:.1f} at [{round(y)}, {round(x)}]"
 
-            if dilate_radius > 0:
-                event_dilated |= skimage.morphology.isotropic_dilation(segmentation_slice, radius=dilate_radius)
             else:
-                event_dilated |= skimage.morphology.isotropic_erosion(segmentation_slice, radius=-dilate_radius)
+                msg = f"Large CR masked with radius={radius:.1f} at [{ig[0]}, {ig[1]}, {round(y)}, {round(x)}]"
+
+            self.log.warning(msg)
+
+    def dilate_jump_slice(self, jump_slice, ig=None):
+        """
+        Dilate a boolean mask with contiguous large areas by a self.growth_factor
+
+        Parameters
+        ----------
+        bool_jump : array-like, bool
+
+        ig : (int, int) or None
+            Integer indices of ``(integer, group)`` for logging
+
+        Returns
+        -------
+        array-like, bool
+        """
+        event_dilated, event_stats = self.measure_and_dilate_jump_slice(jump_slice)
+
+        if self.growth_factor != 0:
+            self.warn_large_events(event_stats, ig=ig)
+
+        return event_dilated
+
+    def measure_and_dilate_jump_slice(self, jump_slice):
+        """
+        Same as ``dilate_jump_slice`` without logging, also returning the event statistics
+
+        Returns
+        -------
+        event_dilated : array-like, bool
+        event_stats : tuple
+            ``(areas, centroids, bboxes)`` of each large area event, see `label_statistics`
+        """
+        cores_filled = self.fill_cores(jump_slice)
+
+        big_events, event_labels, event_stats = self.label_large_events(cores_filled, self.min_radius)
+        event_dilated = self.dilate_events(big_events, event_labels, event_stats, [self.growth_factor])
+
+        return event_dilated[self.growth_factor], event_stats
+
+    def cached_dilate_jump_slice(self, jump_slice, ig=None):
+        """
+        Same as ``dilate_jump_slice``, but look up the result in the on-disk cache first
+
+        The cache key is the content of ``jump_slice`` plus the parameters the dilation
+        depends on.  The area and centroid of large events are cached with the mask, so
+        the same large CR warnings are logged whether or not the result was cached.
+        """
+        if self._cache is None:
+            return self.dilate_jump_slice(jump_slice, ig=ig)
+
+        key = self._cache.make_key(jump_slice, min_radius=self.min_radius, growth_factor=self.growth_factor)
+        cached = self._cache.get(key, jump_slice.shape)
+        if cached is None:
+            event_dilated, (areas, centroids, _) = self.measure_and_dilate_jump_slice(jump_slice)
+            # Only the large events are needed for the warnings
+            large = areas > 900
+            areas, centroids = areas[large], centroids[large]
+            self._cache.put(key, event_dilated, areas=areas, centroids=centroids)
+        else:
+            event_dilated, arrays = cached
+            areas, centroids = arrays["areas"], arrays["centroids"]
+
+        if self.growth_factor != 0:
+            self.warn_large_events((areas, centroids, None), ig=ig)
 
         return event_dilated
 
@@ -138,41 +309,158 @@ class SnowblindStep(Step):
                     if not jump_slice.any():
                         continue
 
-                    dilated_jumps[i, g] |= self.dilate_jump_slice(jump_slice, ig=(i, g))
+                    dilated_jumps[i, g] |= self.cached_dilate_jump_slice(jump_slice, ig=(i, g))
         else:
             if bool_jump.ndim == 3:
                 # e.g., rateints
                 for g in range(bool_jump.shape[0]):
-                    dilated_jumps[g, :, :] |= self.dilate_jump_slice(bool_jump[g, :, :], ig=(0, g))
+                    dilated_jumps[g, :, :] |= self.cached_dilate_jump_slice(bool_jump[g, :, :], ig=(0, g))
             else:
                 # e.g., rate
-                dilated_jumps |= self.dilate_jump_slice(bool_jump, ig=None)
+                dilated_jumps |= self.cached_dilate_jump_slice(bool_jump, ig=None)
 
         return dilated_jumps
 
+    def dilate_cores(self, sat_from_jump, after_jumps, ring_widths):
+        """
+        Dilate the saturated cores by each of ``ring_widths`` and propogate to ``after_jumps``
+        subsequent groups
+
+        The cores of each group are dilated once, within their bounding box padded by the
+        ring width, and the result is ORed into that group and the ``after_jumps`` groups
+        after it.  Groups without cores are skipped.  The distance transform of each group
+        is shared by all ring widths.
+
+        Returns
+        -------
+        dict
+            Boolean mask of the dilated cores for each ring width
+        """
+        dilated_sats = {rw: np.zeros_like(sat_from_jump, dtype=bool) for rw in ring_widths}
+
+        ny, nx = sat_from_jump.shape[-2:]
+        pad = max(int(np.ceil(max(ring_widths))), 0)
+
+        for i, integ in enumerate(sat_from_jump):
+            for g in np.flatnonzero(integ.any(axis=(1, 2))):
+                ys, xs = np.nonzero(integ[g])
+                # Pixels further than the ring width from the bounding box are unaffected
+                crop = (
+                    slice(max(ys.min() - pad, 0), min(ys.max() + 1 + pad, ny)),
+                    slice(max(xs.min() - pad, 0), min(xs.max() + 1 + pad, nx)),
+                )
+                # Same as skimage.morphology.isotropic_dilation, keeping the distances
+                distance = scipy.ndimage.distance_transform_edt(~integ[g][crop])
+
+                # This group and the next after_jumps groups of the integration
+                groups = slice(g, g + max(after_jumps, 0) + 1)
+                for rw, dilated in dilated_sats.items():
+                    dilated[i, groups, crop[0], crop[1]] |= distance <= rw
+
+        return dilated_sats
+
     def dilate_saturated_cores(self, bool_sat, bool_jump):
         """
         Dilate the saturated cores of large CR events and propogate to subsequent groups
         """
-        dilated_sats = np.zeros_like(bool_sat, dtype=bool)
-
         sat_from_jump = bool_sat & bool_jump
 
-        # Propogate the saturated jump core flags to self.after_jumps subsequent group
-        for integration in sat_from_jump:
-            for i in range(self.after_jumps):
-                shifted_flags = np.roll(integration, axis=0, shift=1)
-                # Clean up the first group flags, which now have the last group
-                shifted_flags[0] = False
-                integration |= shifted_flags
+        # Flag the saturated cores dilated by ring width in the group when the jump occurs
+        # plus self.after_jumps subsequent groups
+        return self.dilate_cores(sat_from_jump, self.after_jumps, [self.ring_width])[self.ring_width]
 
-        # Now that the boolean mask shows the saturated cores when the jump occurs
-        # plus self.after_groups subsequent groups, dilate all of these by ring width
-        for i, integ in enumerate(sat_from_jump):
-            for g, grp in enumerate(integ):
-                sat_slice = grp
-                dilated_slice = skimage.morphology.isotropic_dilation(sat_slice, radius=self.ring_width)
+    def sweep(self, input_data, parameter_sets):
+        """
+        Compute the dilated masks for a grid of parameter sets, sharing work between them
 
-                dilated_sats[i, g] = dilated_slice
+        Each intermediate result is computed once per group slice and reused by all the
+        parameter sets that need it: the filled cores, the labeled events for each
+        ``min_radius``, the distance transform of each event for all ``growth_factor``
+        values, and the distance transform of the saturated cores for all ``ring_width``
+        values.
 
-        return dilated_sats
+        Parameters
+        ----------
+        input_data : str or `~jwst.datamodels.JwstDataModel`
+            Output of JumpStep, or a rate or rateints product
+
+        parameter_sets : list of dict
+            Each dict sets any of ``min_radius``, ``growth_factor``, ``ring_width`` and
+            ``after_jumps``.  Parameters not set are taken from the step.
+
+        Returns
+        -------
+        list of dict
+            For each parameter set, a dict with the full set of ``parameters``, the boolean
+            ``mask`` of pixels the step would flag with ``new_jump_flag``, the number of
+            pixels ``n_flagged`` in the mask, the number ``n_new`` of those not already
+            flagged as JUMP_DET, and the ``fraction`` of all pixels flagged.
+        """
+        names = ("min_radius", "growth_factor", "ring_width", "after_jumps")
+        parameters = []
+        for parameter_set in parameter_sets:
+            unknown = set(parameter_set) - set(names)
+            if unknown:
+                raise ValueError(f"Unknown sweep parameters {sorted(unknown)}, expected any of {names}")
+            parameters.append({name: parameter_set.get(name, getattr(self, name)) for name in names})
+
+        with datamodels.open(input_data) as model:
+            bool_jump, bool_sat = self.get_masks(model)
+
+        # Growth factors needed for each min_radius
+        growth_factors = {}
+        for p in parameters:
+            growth_factors.setdefault(p["min_radius"], set()).add(p["growth_factor"])
+
+        dilated_jumps = {
+            (min_radius, gf): np.zeros_like(bool_jump)
+            for min_radius, gfs in growth_factors.items() for gf in gfs
+        }
+
+        # Loop over all 2D slices, whatever the dimensions of the input
+        for index in np.ndindex(bool_jump.shape[:-2]):
+            jump_slice = bool_jump[index]
+            if not jump_slice.any():
+                continue
+
+            cores_filled = self.fill_cores(jump_slice)
+
+            for min_radius, gfs in growth_factors.items():
+                big_events, event_labels, event_stats = self.label_large_events(cores_filled, min_radius)
+                event_dilated = self.dilate_events(big_events, event_labels, event_stats, gfs)
+                for gf, dilated in event_dilated.items():
+                    dilated_jumps[(min_radius, gf)][index] = dilated
+
+        masks = dilated_jumps
+        if self._has_groups:
+            masks = {}
+            # Ring widths needed for each dilated jump mask and after_jumps
+            ring_widths = {}
+            for p in parameters:
+                key = (p["min_radius"], p["growth_factor"], p["after_jumps"])
+                ring_widths.setdefault(key, set()).add(p["ring_width"])
+
+            for (min_radius, gf, after_jumps), rws in ring_widths.items():
+                sat_from_jump = bool_sat & dilated_jumps[(min_radius, gf)]
+                for rw, dilated_sats in self.dilate_cores(sat_from_jump, after_jumps, rws).items():
+                    masks[(min_radius, gf, after_jumps, rw)] = dilated_jumps[(min_radius, gf)] | dilated_sats
+
+        results = []
+        for p in parameters:
+            if self._has_groups:
+                mask = masks[(p["min_radius"], p["growth_factor"], p["after_jumps"], p["ring_width"])]
+            else:
+                mask = masks[(p["min_radius"], p["growth_factor"])]
+
+            n_flagged = int(mask.sum())
+            results.append(dict(
+                parameters=p,
+                mask=mask,
+                n_flagged=n_flagged,
+                n_new=int((mask & ~bool_jump).sum()),
+                fraction=n_flagged / mask.size,
+            ))
+
+            self.log.info(f"Sweep {p}: flagged {n_flagged} pixels")
+
+        return results
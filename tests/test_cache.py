@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+import pytest
+
+from snowblind.cache import MaskCache
+
+
+def test_roundtrip(tmp_path):
+    cache = MaskCache(tmp_path)
+    mask = np.zeros((13, 7), dtype=bool)
+    mask[3:6, 2:4] = True
+
+    key = cache.make_key(mask, min_radius=4, growth_factor=2.0)
+
+    assert cache.get(key, mask.shape) is None
+
+    cache.put(key, mask, areas=np.array([6]))
+
+    cached_mask, arrays = cache.get(key, mask.shape)
+    np.testing.assert_equal(cached_mask, mask)
+    np.testing.assert_equal(arrays["areas"], [6])
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_key(tmp_path):
+    cache_key = MaskCache(tmp_path).make_key
+    mask = np.zeros((10, 10), dtype=bool)
+    mask[5, 5] = True
+
+    key = cache_key(mask, min_radius=4, growth_factor=2.0)
+
+    # Same content and parameters, same key, regardless of parameter order
+    assert key == cache_key(mask.copy(), growth_factor=2.0, min_radius=4)
+
+    # Different parameters or content, different key
+    assert key != cache_key(mask, min_radius=4, growth_factor=1.0)
+    assert key != cache_key(~mask, min_radius=4, growth_factor=2.0)
+    assert key != cache_key(mask.reshape(4, 25), min_radius=4, growth_factor=2.0)
+
+
+def test_prune(tmp_path):
+    cache = MaskCache(tmp_path, max_size=0)
+    mask = np.ones((100, 100), dtype=bool)
+
+    for radius in range(3):
+        key = cache.make_key(mask, min_radius=radius)
+        cache.put(key, mask)
+        os.utime(tmp_path / f"{key}.npz", times=(radius, radius))
+
+    size = (tmp_path / f"{cache.make_key(mask, min_radius=0)}.npz").stat().st_size
+    cache.max_size = 2 * size
+
+    # Use the oldest entry, so it is kept while the least recently used one is evicted
+    cache.get(cache.make_key(mask, min_radius=0), mask.shape)
+
+    assert cache.prune() == 2 * size
+    assert cache.get(cache.make_key(mask, min_radius=0), mask.shape) is not None
+    assert cache.get(cache.make_key(mask, min_radius=1), mask.shape) is None
+    assert cache.get(cache.make_key(mask, min_radius=2), mask.shape) is not None
+
+
+@pytest.mark.parametrize("damage", ["empty", "truncated", "no mask"])
+def test_damaged_entry(tmp_path, damage):
+    cache = MaskCache(tmp_path)
+    mask = np.ones((10, 10), dtype=bool)
+    key = cache.make_key(mask)
+    filename = tmp_path / f"{key}.npz"
+
+    if damage == "empty":
+        filename.write_bytes(b"")
+    elif damage == "truncated":
+        cache.put(key, mask)
+        filename.write_bytes(filename.read_bytes()[:50])
+    else:
+        np.savez(filename, areas=np.array([1]))
+
+    # A damaged entry is a miss, and is removed
+    assert cache.get(key, mask.shape) is None
+    assert cache.misses == 1
+    assert not filename.exists()
@@ -0,0 +1,165 @@
+import warnings
+
+import numpy as np
+import pytest
+from jwst import datamodels
+from astropy.time import Time
+
+from snowblind import (
+    SnowblindStep,
+    JumpPlusStep,
+    OpenPixelStep,
+    PersistenceFlagStep,
+    apply_dq_delta,
+    open_with_dq_delta,
+)
+from snowblind.dqdelta import compute_dq_delta, compute_flag_delta, write_dq_delta, read_dq_delta
+
+
+JUMP_DET = datamodels.dqflags.group["JUMP_DET"]
+SATURATED = datamodels.dqflags.group["SATURATED"]
+
+
+def test_roundtrip(tmp_path):
+    rng = np.random.default_rng(3)
+    original = rng.integers(0, 2**16, size=(3, 20, 30), dtype=np.uint32)
+    updated = original | (rng.random(original.shape) < 0.01) * np.uint32(2**30)
+    # Bits at 2**31 and above need the unsigned offset in FITS
+    updated[0, 0, :3] |= np.uint32(2**31 | 4)
+
+    index, bits = compute_dq_delta(original, updated)
+
+    assert len(index) == (updated != original).sum()
+
+    filename = tmp_path / "delta.fits"
+    source = "jw01234567001_03101_00001_nrcalong_snowblind_jump.fits"
+    with warnings.catch_warnings():
+        # No truncated header cards for real filenames
+        warnings.simplefilter("error")
+        write_dq_delta(filename, {"dq": (original.shape, index, bits)}, source=source, cal_step=("snowblind", "COMPLETE"))
+    deltas, header = read_dq_delta(filename)
+
+    assert header["SRCFILE"] == source
+    shape, index_read, bits_read = deltas["dq"]
+    assert shape == original.shape
+    np.testing.assert_equal(index_read, index)
+    np.testing.assert_equal(bits_read, bits)
+    assert bits_read.dtype == np.uint32
+
+    model = datamodels.CubeModel(original.shape)
+    model.dq = original.copy()
+    apply_dq_delta(model, filename)
+
+    np.testing.assert_equal(model.dq, updated)
+    assert model.meta.cal_step.snowblind == "COMPLETE"
+
+
+def test_flag_delta():
+    rng = np.random.default_rng(4)
+    dq = rng.integers(0, 2**8, size=(2, 5, 20, 30), dtype=np.uint8)
+    added = rng.random(dq.shape) < 0.1
+    flag = 4 | 64
+
+    index, bits = compute_flag_delta(dq, added, flag)
+
+    # Same as diffing against a copy of the DQ
+    expected_index, expected_bits = compute_dq_delta(dq, dq | (added * flag).astype(np.uint8))
+    np.testing.assert_equal(index, expected_index)
+    np.testing.assert_equal(bits, expected_bits)
+    assert bits.dtype == dq.dtype
+
+
+def test_shape_mismatch(tmp_path):
+    index, bits = compute_dq_delta(np.zeros((5, 5), np.uint32), np.ones((5, 5), np.uint32))
+    filename = tmp_path / "delta.fits"
+    write_dq_delta(filename, {"dq": ((5, 5), index, bits)})
+
+    with pytest.raises(ValueError, match="shape"):
+        apply_dq_delta(datamodels.ImageModel((6, 6)), filename)
+
+
+def ramp_model():
+    im = datamodels.RampModel((1, 6, 40, 40))
+    im.meta.filename = "jw001234_010203_00001_nrcalong_jump.fits"
+    im.meta.exposure.nframes = 2
+    im.groupdq[0, 1, 15:26, 15:26] = JUMP_DET
+    im.groupdq[0, 1, 20, 20] = SATURATED
+    im.groupdq[0, 1, 5, 5] = JUMP_DET
+
+    return im
+
+
+@pytest.mark.parametrize("step_class", [SnowblindStep, JumpPlusStep])
+def test_ramp_steps(step_class, tmp_path):
+    im = ramp_model()
+    input_file = tmp_path / im.meta.filename
+    im.save(input_file)
+
+    result = step_class.call(input_file, dq_delta=True, save_results=True, output_dir=str(tmp_path))
+
+    # Only the input and the sidecar, no full product
+    sidecars = list(tmp_path.glob("*_dqdelta.fits"))
+    assert len(sidecars) == 1
+    assert len(list(tmp_path.iterdir())) == 2
+
+    with open_with_dq_delta(input_file, sidecars[0]) as merged:
+        np.testing.assert_equal(merged.groupdq, result.groupdq)
+        assert getattr(merged.meta.cal_step, step_class.class_alias) == "COMPLETE"
+
+
+def test_open_pixel(tmp_path):
+    images = datamodels.ModelContainer()
+    rng = np.random.default_rng()
+    for i in range(10):
+        image = datamodels.ImageModel(rng.normal(scale=0.08, size=(10, 10)))
+        image.data[2, 2] += 1.0
+        image.meta.instrument.detector = "NRCALONG"
+        image.meta.filename = f"jw001234_{i}_nrcalong_cal.fits"
+        images.append(image)
+
+    results = OpenPixelStep.call(images, dq_delta=True, save_results=True, suffix="cal", output_dir=str(tmp_path))
+
+    for image, result in zip(images, results):
+        sidecar = tmp_path / image.meta.filename.replace("_cal.fits", "_cal_dqdelta.fits")
+        merged = apply_dq_delta(image.copy(), sidecar)
+        np.testing.assert_equal(merged.dq, result.dq)
+        assert merged.dq[2, 2] != 0
+
+
+def test_persist(tmp_path):
+    images = datamodels.ModelContainer()
+    time0 = Time(60122.0226664904, format="mjd")
+    for i in range(3):
+        image = datamodels.ImageModel((10, 10))
+        image.meta.instrument.detector = "NRCALONG"
+        image.meta.filename = f"jw01125002001_03101_0000{i}_nrcalong_cal.fits"
+        image.meta.exposure.start_time = time0.value + i * 0.0132
+        images.append(image)
+
+        jump = datamodels.RampModel((1, 5, *image.data.shape))
+        jump.groupdq[0, -1, i, i] = SATURATED
+        jump.save(tmp_path / image.meta.filename.replace("_cal", "_jump"))
+
+    results = PersistenceFlagStep.call(
+        images, input_dir=str(tmp_path), dq_delta=True, save_results=True, suffix="cal", output_dir=str(tmp_path)
+    )
+
+    for image, result in zip(images, results):
+        sidecar = tmp_path / image.meta.filename.replace("_cal.fits", "_cal_dqdelta.fits")
+        merged = apply_dq_delta(image.copy(), sidecar)
+        np.testing.assert_equal(merged.dq, result.dq)
+
+    assert results[1].dq[0, 0] != 0
+
+
+def test_deltas_not_kept(tmp_path):
+    im = ramp_model()
+    step = SnowblindStep(dq_delta=True, save_results=True, output_dir=str(tmp_path))
+
+    for _ in range(2):
+        step.run(im)
+
+        # The output models are not kept alive by the step after each run
+        assert step._dq_deltas is None
+
+    assert len(list(tmp_path.glob("*_dqdelta.fits"))) == 1
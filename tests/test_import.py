@@ -0,0 +1,41 @@
+import subprocess
+import sys
+
+import pytest
+
+import snowblind
+
+
+HEAVY_MODULES = ["jwst", "stdatamodels", "stpipe", "skimage", "scipy", "astropy"]
+
+
+def test_get_steps_is_cheap():
+    # Run in a fresh interpreter, as other tests have already imported everything
+    code = "\n".join([
+        "import sys",
+        "import snowblind",
+        "snowblind._get_steps()",
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))",
+    ])
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == ""
+
+
+@pytest.mark.parametrize("name, alias", [
+    ("SnowblindStep", "snowblind"),
+    ("JumpPlusStep", "jump_plus"),
+    ("OpenPixelStep", "open_pixel"),
+    ("PersistenceFlagStep", "persist"),
+])
+def test_lazy_steps(name, alias):
+    step = getattr(snowblind, name)
+
+    assert step.class_alias == alias
+    assert name in dir(snowblind)
+    assert (f"snowblind.{name}", alias, False) in snowblind._get_steps()
+
+
+def test_missing_attribute():
+    with pytest.raises(AttributeError, match="no_such_step"):
+        snowblind.no_such_step
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from snowblind.maskio import read_mask, read_mask_header, write_mask
+
+
+@pytest.mark.parametrize("shape", [(10, 10), (7, 13), (2, 3, 5, 17)])
+def test_roundtrip(shape, tmp_path):
+    rng = np.random.default_rng(1)
+    mask = rng.random(shape) < 0.3
+
+    filename = tmp_path / "mask.fits"
+    write_mask(filename, mask, header=dict(DETECTOR="NRCALONG"))
+
+    np.testing.assert_equal(read_mask(filename), mask)
+    assert read_mask_header(filename)["DETECTOR"] == "NRCALONG"
+
+
+def test_index(tmp_path):
+    rng = np.random.default_rng(2)
+    mask = rng.random((2, 4, 20, 30)) < 0.3
+
+    filename = tmp_path / "mask.fits"
+    write_mask(filename, mask)
+
+    np.testing.assert_equal(read_mask(filename, index=(-1, -1)), mask[-1, -1])
+
+
+def test_compact(tmp_path):
+    mask = np.ones((2048, 2048), dtype=bool)
+
+    filename = tmp_path / "mask.fits"
+    write_mask(filename, mask)
+
+    assert filename.stat().st_size < mask.size / 8 + 10 * 2880
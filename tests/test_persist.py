@@ -1,5 +1,7 @@
 import numpy as np
+import pytest
 from jwst import datamodels
+from astropy.io import fits
 from astropy.time import Time
 
 from snowblind import PersistenceFlagStep
@@ -17,7 +19,7 @@ def test_init():
     assert step.time == 1000
 
 
-def test_input_dir(tmp_path):
+def make_images(tmp_path):
     images = datamodels.ModelContainer()
 
     time0 = Time(60122.0226664904, format="mjd")
@@ -51,6 +53,12 @@ def test_input_dir(tmp_path):
         jump.groupdq[0, -1] = image.dq
         jump.save(tmp_path / image.meta.filename.replace("_cal", "_jump"))
 
+    return images
+
+
+def test_input_dir(tmp_path):
+    images = make_images(tmp_path)
+
     # Run the step and see if they're recovered
     results = PersistenceFlagStep.call(images, input_dir=str(tmp_path))
 
@@ -60,3 +68,62 @@ def test_input_dir(tmp_path):
 
     assert results[8].dq[2, 2] == GOOD
     assert results[1].dq[0, 0] == GOOD
+
+
+def test_save_mask(tmp_path, tmp_cwd):
+    images = make_images(tmp_path)
+    PersistenceFlagStep.call(images, input_dir=str(tmp_path), save_mask=True)
+
+    # By default the masks are the uint8 saturation cubes of the _jump files
+    sat_masks = sorted(tmp_cwd.glob("*_satmask.fits"))
+    assert len(sat_masks) == len(images)
+    assert not list(tmp_cwd.glob("*_packedsatmask.fits"))
+
+    sat_mask = fits.getdata(tmp_cwd / images[0].meta.filename.replace("_cal", "_satmask"))
+    assert sat_mask.shape == (1, 5, 10, 10)
+    assert sat_mask[0, -1, 2, 2] == 1
+
+
+def test_saved_mask(tmp_cwd):
+    input_dir = tmp_cwd / "input"
+    input_dir.mkdir()
+    images = make_images(input_dir)
+
+    # Masks are saved in the current directory, and found there on rerun
+    results = PersistenceFlagStep.call(images, input_dir=str(input_dir), save_mask=True, packed_mask=True)
+
+    sat_masks = sorted(tmp_cwd.glob("*_packedsatmask.fits"))
+    assert len(sat_masks) == len(images)
+
+    # Without the _jump files, the saved masks give the same result
+    for jump_file in input_dir.glob("*_jump.fits"):
+        jump_file.unlink()
+
+    results_saved = PersistenceFlagStep.call(images, input_dir=str(input_dir), use_saved_mask=True)
+
+    for result, result_saved in zip(results, results_saved):
+        np.testing.assert_equal(result_saved.dq, result.dq)
+
+    with pytest.raises(FileNotFoundError):
+        PersistenceFlagStep.call(images, input_dir=str(input_dir))
+
+
+def test_association(tmp_path):
+    from jwst.associations import asn_from_list
+
+    images = make_images(tmp_path)
+    for image in images:
+        image.save(tmp_path / image.meta.filename)
+
+    asn = asn_from_list.asn_from_list([image.meta.filename for image in images], product_name="test")
+    asn_file = tmp_path / "test_asn.json"
+    asn_file.write_text(asn.dump()[1])
+
+    # Reading the exposures from disk in the background gives the same result
+    results = PersistenceFlagStep.call(images, input_dir=str(tmp_path))
+    results_asn = PersistenceFlagStep.call(str(asn_file), input_dir=str(tmp_path), read_ahead=3)
+
+    assert results_asn.asn_table_name == "test_asn.json"
+    for result, result_asn in zip(results, results_asn):
+        assert result_asn.meta.filename == result.meta.filename
+        np.testing.assert_equal(result_asn.dq, result.dq)
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from snowblind.prefetch import prefetch_map
+
+
+@pytest.mark.parametrize("depth", [0, 1, 3])
+def test_order(depth):
+    rng = np.random.default_rng(0)
+    delays = rng.uniform(0, 0.01, size=20)
+
+    def read(i):
+        # Later items finish first, but are still yielded in order
+        time.sleep(delays[i])
+        return i
+
+    assert list(prefetch_map(read, range(20), depth=depth)) == list(range(20))
+
+
+class Reads:
+    """Record which items the background threads have started reading"""
+
+    def __init__(self, size=10):
+        self.started = []
+        self.size = size
+        self.condition = threading.Condition()
+
+    def __call__(self, i):
+        with self.condition:
+            self.started.append(i)
+            self.condition.notify_all()
+        return np.zeros(self.size, dtype=np.uint8)
+
+    def wait(self, n):
+        # Items are only submitted within next(), so once n reads have started no
+        # more can start until the next call
+        with self.condition:
+            assert self.condition.wait_for(lambda: len(self.started) >= n, timeout=10)
+            return sorted(self.started)
+
+
+def test_read_ahead():
+    read = Reads()
+
+    results = prefetch_map(read, range(10), depth=3)
+    next(results)
+
+    # The first item plus the 3 next ones have been read, no more
+    assert read.wait(4) == [0, 1, 2, 3]
+
+    assert len(list(results)) == 9
+
+
+def test_max_memory():
+    read = Reads(size=1024**2)
+
+    results = prefetch_map(read, range(20), depth=4, max_memory=1.5)
+    for _ in range(6):
+        next(results)
+
+    # Once the result size is known, only one 1 MB item is read ahead, not 4
+    assert read.wait(7) == list(range(7))
+
+
+def test_exception():
+    def read(i):
+        if i == 2:
+            raise OSError("cannot read")
+        return i
+
+    results = prefetch_map(read, range(5), depth=2)
+
+    assert next(results) == 0
+    assert next(results) == 1
+    with pytest.raises(OSError, match="cannot read"):
+        next(results)
+
+
+def test_open_association(tmp_path):
+    from jwst import datamodels
+    from jwst.associations import asn_from_list
+
+    from snowblind.prefetch import open_association
+
+    filenames = []
+    for i in range(5):
+        model = datamodels.ImageModel(np.full((10, 10), i, dtype=np.float32))
+        model.meta.filename = f"image{i}_cal.fits"
+        model.save(tmp_path / model.meta.filename)
+        filenames.append(model.meta.filename)
+
+    asn = asn_from_list.asn_from_list(filenames, product_name="test")
+    asn_file = tmp_path / "test_asn.json"
+    asn_file.write_text(asn.dump()[1])
+
+    with open_association(str(asn_file), arrays=("data", "dq"), depth=2) as models:
+        assert [m.meta.filename for m in models] == filenames
+        assert [m.data[0, 0] for m in models] == list(range(5))
+        assert models[0].meta.asn.exptype == "science"
+        assert models[0].meta.asn.table_name == "test_asn.json"
+
+    with open_association([tmp_path / f for f in filenames], arrays=("data",), depth=2) as models:
+        assert [m.data[0, 0] for m in models] == list(range(5))
+
+        # Models in memory are copied
+        copies = open_association(models)
+        copies[0].data[0, 0] = 10
+        assert models[0].data[0, 0] == 0
@@ -15,7 +15,7 @@ def test_init():
     assert step.threshold == 4.5
 
 
-def test_call():
+def make_images():
     images = datamodels.ModelContainer()
     rng = np.random.default_rng()
 
@@ -40,6 +40,12 @@ def test_call():
         image.data[3, 5] += 5 * stddev
         image.data[8, 8] += 3 * stddev
 
+    return images
+
+
+def test_call():
+    images = make_images()
+
     # Run the step and see if they're recovered
     results = OpenPixelStep.call(images, threshold=3.0)
 
@@ -49,3 +55,83 @@ def test_call():
         assert result.dq[8, 8] == ADJ_OPEN | DO_NOT_USE
 
         assert result.dq[5, 5] == GOOD
+
+
+def test_save_mask(tmp_cwd):
+    images = make_images()
+    OpenPixelStep.call(images, save_mask=True)
+
+    # By default the masks are MaskModels
+    mask_files = sorted(tmp_cwd.glob("*_mask.fits"))
+    assert len(mask_files) == 2
+    assert not list(tmp_cwd.glob("*_packedmask.fits"))
+    with datamodels.open(mask_files[0]) as mask_model:
+        assert isinstance(mask_model, datamodels.MaskModel)
+        assert mask_model.dq[2, 2] == ADJ_OPEN | DO_NOT_USE
+        assert mask_model.dq[5, 5] == GOOD
+
+
+def test_saved_mask(tmp_cwd):
+    images = make_images()
+    OpenPixelStep.call(images, save_mask=True, packed_mask=True)
+
+    mask_files = sorted(tmp_cwd.glob("*_packedmask.fits"))
+    assert len(mask_files) == 2
+    assert len(list(tmp_cwd.glob("*_median.fits"))) == 2
+
+    # Hot pixels are only in the saved masks, not in the new data
+    for image in images:
+        image.data[:] = 0.0
+
+    results = OpenPixelStep.call(images, use_saved_mask=True, input_dir=str(tmp_cwd))
+
+    for result in results:
+        assert result.dq[2, 2] == ADJ_OPEN | DO_NOT_USE
+        assert result.dq[5, 5] == GOOD
+
+
+def test_saved_mask_provenance(tmp_cwd):
+    images = make_images()
+    OpenPixelStep.call(images, save_mask=True, packed_mask=True, threshold=3.0)
+
+    for image in images:
+        image.data[:] = 0.0
+
+    # A mask saved with another threshold is recomputed, from the new data
+    results = OpenPixelStep.call(images, use_saved_mask=True, input_dir=str(tmp_cwd), threshold=4.0)
+
+    for result in results:
+        assert result.dq[2, 2] == GOOD
+
+
+def test_saved_mask_output_dir(tmp_path):
+    images = make_images()
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    OpenPixelStep.call(images, save_mask=True, packed_mask=True, output_dir=str(output_dir))
+
+    for image in images:
+        image.data[:] = 0.0
+
+    # The masks are found where they were saved, not only in input_dir
+    results = OpenPixelStep.call(images, use_saved_mask=True, input_dir=str(tmp_path), output_dir=str(output_dir))
+
+    for result in results:
+        assert result.dq[2, 2] == ADJ_OPEN | DO_NOT_USE
+
+
+def test_saved_mask_members(tmp_cwd):
+    images = make_images()
+    OpenPixelStep.call(images, save_mask=True, packed_mask=True)
+
+    for image in images:
+        image.data[:] = 0.0
+
+    # Dropping an NRCBLONG exposure keeps the mask filename, but that mask is recomputed
+    results = OpenPixelStep.call(images[:-1], use_saved_mask=True)
+
+    for result in results:
+        if result.meta.instrument.detector == "NRCALONG":
+            assert result.dq[2, 2] == ADJ_OPEN | DO_NOT_USE
+        else:
+            assert result.dq[2, 2] == GOOD
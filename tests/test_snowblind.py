@@ -1,7 +1,10 @@
+import numpy as np
 import pytest
+import skimage
 from stdatamodels.jwst import datamodels
 
 from snowblind import SnowblindStep
+from snowblind.snowblind import label_statistics
 
 
 JUMP_DET = datamodels.dqflags.group['JUMP_DET']
@@ -56,6 +59,10 @@ def test_ramp():
     assert result.groupdq[0, 3, 22, 20] == JUMP_DET
     assert result.groupdq[0, 4, 22, 20] == GOOD
 
+    # Verify that groups without saturated cores get no flags at the array corner
+    assert result.groupdq[0, 0, 0, 0] == GOOD
+    assert result.groupdq[0, 5, 0, 0] == GOOD
+
 
 def test_rate():
     # Image mode, e.g., rate products
@@ -104,3 +111,118 @@ def test_step_complete(im, tmp_path):
 
     with datamodels.open(filename) as result_reopened:
         assert result_reopened.meta.cal_step.snowblind == "COMPLETE"
+
+
+@pytest.mark.parametrize("im", snowball_data())
+def test_cache(im, tmp_path):
+    cache_dir = tmp_path / "cache"
+    result = SnowblindStep.call(im)
+    result_cold = SnowblindStep.call(im, cache_dir=str(cache_dir))
+
+    assert any(cache_dir.iterdir())
+
+    result_warm = SnowblindStep.call(im, cache_dir=str(cache_dir))
+
+    if hasattr(im, "groupdq"):
+        np.testing.assert_equal(result_cold.groupdq, result.groupdq)
+        np.testing.assert_equal(result_warm.groupdq, result.groupdq)
+    else:
+        np.testing.assert_equal(result_cold.dq, result.dq)
+        np.testing.assert_equal(result_warm.dq, result.dq)
+
+
+@pytest.mark.parametrize("im", snowball_data())
+def test_sweep(im):
+    parameter_sets = [
+        dict(min_radius=4, growth_factor=2.0),
+        dict(min_radius=4, growth_factor=1.5, ring_width=3.0),
+        dict(min_radius=3, growth_factor=0.0, after_jumps=1),
+        dict(min_radius=2, growth_factor=-0.2),
+    ]
+    results = SnowblindStep().sweep(im, parameter_sets)
+
+    assert len(results) == len(parameter_sets)
+
+    # Each mask is the same as what the step flags with the same parameters
+    flag = 128
+    for parameter_set, result in zip(parameter_sets, results):
+        step_result = SnowblindStep.call(im, new_jump_flag=flag, **parameter_set)
+        dq = step_result.groupdq if hasattr(im, "groupdq") else step_result.dq
+
+        np.testing.assert_equal(result["mask"], (dq & flag) == flag)
+        assert result["n_flagged"] == result["mask"].sum()
+        assert result["parameters"]["ring_width"] == parameter_set.get("ring_width", 2.0)
+
+
+def test_sweep_unknown_parameter():
+    im, _, _ = snowball_data()
+
+    with pytest.raises(ValueError, match="new_jump_flag"):
+        SnowblindStep().sweep(im, [dict(new_jump_flag=4096)])
+
+
+def test_label_statistics():
+    rng = np.random.default_rng(42)
+    labels = skimage.measure.label(rng.random((60, 50)) > 0.7)
+    nlabels = labels.max()
+
+    areas, centroids, bboxes = label_statistics(labels, nlabels)
+
+    regions = skimage.measure.regionprops(labels)
+    assert len(areas) == len(centroids) == len(bboxes) == len(regions) == nlabels
+    for region, area, centroid, bbox in zip(regions, areas, centroids, bboxes):
+        assert area == region.area
+        np.testing.assert_allclose(centroid, region.centroid)
+        assert (bbox[0].start, bbox[1].start, bbox[0].stop, bbox[1].stop) == region.bbox
+
+
+@pytest.mark.parametrize("after_jumps, ring_width", [(0, 2.0), (2, 2.0), (3, 1.5), (10, 3.0)])
+def test_dilate_saturated_cores(after_jumps, ring_width):
+    rng = np.random.default_rng(7)
+    bool_sat = rng.random((2, 8, 30, 40)) < 0.002
+    bool_jump = np.ones_like(bool_sat)
+    bool_sat[:, 0] = False
+    bool_sat[1, 2:] = False
+
+    step = SnowblindStep(after_jumps=after_jumps, ring_width=ring_width)
+    dilated_sats = step.dilate_saturated_cores(bool_sat, bool_jump)
+
+    # Propagate the cores to the next after_jumps groups, then dilate each group with cores
+    expected = np.zeros_like(bool_sat)
+    for i in range(bool_sat.shape[0]):
+        for g in range(bool_sat.shape[1]):
+            cores = bool_sat[i, max(g - after_jumps, 0):g + 1].any(axis=0)
+            if cores.any():
+                expected[i, g] = skimage.morphology.isotropic_dilation(cores, radius=ring_width)
+
+    np.testing.assert_equal(dilated_sats, expected)
+
+
+def test_cache_warnings(tmp_path, caplog):
+    im = datamodels.RampModel((1, 3, 100, 100))
+    im.groupdq[0, 1, 20:60, 20:60] = JUMP_DET
+    cache_dir = str(tmp_path / "cache")
+
+    for _ in range(2):
+        caplog.clear()
+        SnowblindStep.call(im, cache_dir=cache_dir)
+
+        # The large CR warning is logged on both the cold and warm runs
+        assert "Large CR masked with radius=22.3 at [0, 1, 40, 40]" in caplog.text
+
+    assert "1 hits, 0 misses" in caplog.text
+
+
+def test_cache_cleared_on_error(tmp_path, monkeypatch):
+    im, _, _ = snowball_data()
+    step = SnowblindStep(cache_dir=str(tmp_path / "cache"))
+
+    def fail(bool_jump):
+        raise RuntimeError("dilation failed")
+
+    monkeypatch.setattr(step, "dilate_large_area_jumps", fail)
+
+    with pytest.raises(RuntimeError, match="dilation failed"):
+        step.run(im)
+
+    assert step._cache is None